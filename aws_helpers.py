@@ -0,0 +1,91 @@
+# scripts/aws_helpers.py
+
+import json
+import uuid
+from datetime import datetime, timezone
+from botocore.config import Config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from ulid import ULID
+except ImportError:
+    # python-ulid needs Python 3.9+
+    ULID = None
+
+# Shared by every AWS client: client-side rate limiting via adaptive
+# retries and a connection pool sized for the parallel S3/EC2 calls
+BOTO_CONFIG = Config(
+    retries={'mode': 'adaptive', 'max_attempts': 10},
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    connect_timeout=5,
+    read_timeout=60
+)
+
+CROCKFORD_BASE32 = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+
+def dump_json(obj, pretty=False):
+    """Encode obj as compact JSON bytes (indented when pretty)"""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0)
+    if pretty:
+        return json.dumps(obj, indent=2).encode()
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+def load_json(data):
+    """Decode JSON bytes or str; raises ValueError on malformed input"""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def new_record_id():
+    """Unique, time-ordered name for a new S3 record
+    
+    A ULID when python-ulid is installed, otherwise a UTC ISO timestamp with
+    a random suffix.
+    """
+    if ULID:
+        return str(ULID())
+    return f"{datetime.now(timezone.utc).isoformat()}_{uuid.uuid4().hex[:8]}"
+
+
+def record_timestamp(name):
+    """Creation time in seconds encoded in a record name, or None if unrecognised
+    
+    Understands ULIDs (decoded directly, so python-ulid is not needed) and
+    ISO timestamps, with or without a random suffix. Only legacy keys lack a
+    UTC offset; those are read as local time.
+    """
+    try:
+        return datetime.fromisoformat(name.split('_', 1)[0]).timestamp()
+    except ValueError:
+        pass
+    
+    # The first 10 characters of a ULID are its 48-bit millisecond timestamp
+    name = name.upper()
+    if len(name) != 26 or any(c not in CROCKFORD_BASE32 for c in name):
+        return None
+    millis = 0
+    for c in name[:10]:
+        millis = millis * 32 + CROCKFORD_BASE32.index(c)
+    return millis / 1000
+
+
+def describe_asg(autoscaling, asg_name, cache):
+    """Describe an Auto Scaling Group, memoized in cache for the lifetime of the run"""
+    if asg_name not in cache:
+        response = autoscaling.describe_auto_scaling_groups(
+            AutoScalingGroupNames=[asg_name]
+        )
+        groups = response['AutoScalingGroups']
+        if not groups:
+            return None
+        cache[asg_name] = groups[0]
+    return cache[asg_name]
@@ -3,10 +3,18 @@
 
 import argparse
 import boto3
+import functools
+import re
 import time
 import sys
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from botocore.exceptions import BotoCoreError, ClientError
+
+from aws_helpers import BOTO_CONFIG, describe_asg, dump_json, new_record_id
+from refresh_events import describe_refresh, wait_for_refresh
+from user_data import build_user_data
 
 # Configure logging
 logging.basicConfig(
@@ -15,15 +23,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+ECR_IMAGE_RE = re.compile(
+    r'^(\d{12})\.dkr\.ecr\.([a-z0-9-]+)\.amazonaws\.com/([^:@]+)(?::([^@]+))?$'
+)
+
 
 class DeploymentManager:
-    def __init__(self, environment, region='us-east-1'):
+    def __init__(self, environment, region='us-east-1', debug=False):
         self.environment = environment
         self.region = region
-        self.autoscaling = boto3.client('autoscaling', region_name=region)
-        self.ec2 = boto3.client('ec2', region_name=region)
-        self.elb = boto3.client('elbv2', region_name=region)
-        self.s3 = boto3.client('s3', region_name=region)
+        self.debug = debug
+        self.autoscaling = boto3.client('autoscaling', region_name=region, config=BOTO_CONFIG)
+        self.ec2 = boto3.client('ec2', region_name=region, config=BOTO_CONFIG)
+        self.elb = boto3.client('elbv2', region_name=region, config=BOTO_CONFIG)
+        self.ecr = boto3.client('ecr', region_name=region, config=BOTO_CONFIG)
+        self.s3 = boto3.client('s3', region_name=region, config=BOTO_CONFIG)
+        self._asg_cache = {}
         
     def get_asg_name(self):
         """Get Auto Scaling Group name for environment"""
@@ -33,19 +48,25 @@ class DeploymentManager:
     
     def update_launch_template(self, image):
         """Update launch template with new Docker image"""
+        created = self._create_launch_template_version(image)
+        if not created:
+            return False
+        
+        self._set_asg_launch_template(*created)
+        return True
+    
+    def _create_launch_template_version(self, image):
+        """Create a launch template version for image; returns (asg, lt_id, version)"""
         logger.info(f"Updating launch template with image: {image}")
         
         # Get current launch template
         asg_name = self.get_asg_name()
-        response = self.autoscaling.describe_auto_scaling_groups(
-            AutoScalingGroupNames=[asg_name]
-        )
+        asg = describe_asg(self.autoscaling, asg_name, self._asg_cache)
         
-        if not response['AutoScalingGroups']:
+        if not asg:
             logger.error(f"ASG {asg_name} not found")
-            return False
+            return None
         
-        asg = response['AutoScalingGroups'][0]
         lt_id = asg['LaunchTemplate']['LaunchTemplateId']
         
         # Create new version with updated user data
@@ -61,65 +82,89 @@ class DeploymentManager:
         
         new_version = response['LaunchTemplateVersion']['VersionNumber']
         logger.info(f"Created launch template version: {new_version}")
-        
-        # Update ASG to use new version
+        return asg_name, lt_id, new_version
+    
+    def _set_asg_launch_template(self, asg_name, lt_id, version):
+        """Point the ASG at a launch template version"""
         self.autoscaling.update_auto_scaling_group(
             AutoScalingGroupName=asg_name,
             LaunchTemplate={
                 'LaunchTemplateId': lt_id,
-                'Version': str(new_version)
+                'Version': str(version)
             }
         )
+    
+    def _delete_launch_template_version(self, lt_id, version):
+        """Delete a launch template version that will not be used"""
+        try:
+            self.ec2.delete_launch_template_versions(
+                LaunchTemplateId=lt_id,
+                Versions=[str(version)]
+            )
+            logger.info(f"Deleted unused launch template version: {version}")
+        except (BotoCoreError, ClientError) as e:
+            logger.warning(f"Failed to delete launch template version {version}: {e}")
+    
+    def _validate_image(self, image):
+        """Confirm an ECR image tag exists; other registries are not checked"""
+        match = ECR_IMAGE_RE.match(image)
+        if not match:
+            return True
+        
+        registry_id, region, repository, tag = match.groups()
+        if region == self.region:
+            ecr = self.ecr
+        else:
+            ecr = boto3.client('ecr', region_name=region, config=BOTO_CONFIG)
+        
+        try:
+            ecr.describe_images(
+                registryId=registry_id,
+                repositoryName=repository,
+                imageIds=[{'imageTag': tag or 'latest'}]
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('ImageNotFoundException',
+                                               'RepositoryNotFoundException'):
+                logger.error(f"Image {image} not found in ECR")
+                return False
+            # Optional pre-check (e.g. no ecr:DescribeImages permission)
+            logger.warning(f"Could not verify image {image} in ECR, continuing: {e}")
+        except BotoCoreError as e:
+            logger.warning(f"Could not verify image {image} in ECR, continuing: {e}")
         
         return True
     
     def _generate_user_data(self, image):
         """Generate user data script for EC2 instances"""
-        import base64
-        
-        script = f"""#!/bin/bash
-set -e
-
-# Pull new image
-docker pull {image}
-
-# Stop old container
-docker stop app || true
-docker rm app || true
-
-# Run new container
-docker run -d \\
-  --name app \\
-  --restart unless-stopped \\
-  -p 3000:3000 \\
-  -e NODE_ENV={self.environment} \\
-  {image}
-
-# Wait for health check
-for i in {{1..30}}; do
-  if curl -f http://localhost:3000/health > /dev/null 2>&1; then
-    echo "Application is healthy!"
-    exit 0
-  fi
-  sleep 2
-done
-
-echo "Application failed to start"
-exit 1
-"""
-        return base64.b64encode(script.encode()).decode()
+        return build_user_data(self.environment, image)
     
     def rolling_deployment(self, image):
         """Perform rolling deployment"""
         logger.info(f"Starting rolling deployment for {self.environment}")
         
-        # Update launch template
-        if not self.update_launch_template(image):
+        # Validate the image while the new launch template version is created
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            image_check = executor.submit(self._validate_image, image)
+            lt_update = executor.submit(self._create_launch_template_version, image)
+            image_ok = image_check.result()
+            created = lt_update.result()
+        
+        if not created:
             logger.error("Failed to update launch template")
             return False
         
+        if not image_ok:
+            # Don't leave the unusable version as $Latest for the next deploy
+            _, lt_id, version = created
+            self._delete_launch_template_version(lt_id, version)
+            return False
+        
+        # Only switch the ASG once both checks have passed
+        self._set_asg_launch_template(*created)
+        
         # Start instance refresh
-        asg_name = self.get_asg_name()
+        asg_name = created[0]
         logger.info(f"Starting instance refresh for {asg_name}")
         
         response = self.autoscaling.start_instance_refresh(
@@ -141,60 +186,70 @@ exit 1
         """Monitor instance refresh progress"""
         logger.info("Monitoring instance refresh...")
         
-        while True:
-            response = self.autoscaling.describe_instance_refreshes(
-                AutoScalingGroupName=asg_name,
-                InstanceRefreshIds=[refresh_id]
-            )
-            
-            if not response['InstanceRefreshes']:
-                logger.error("Instance refresh not found")
-                return False
-            
-            refresh = response['InstanceRefreshes'][0]
-            status = refresh['Status']
-            
-            if status == 'Successful':
-                logger.info("✅ Instance refresh completed successfully")
-                return True
-            elif status in ['Cancelled', 'Failed']:
-                logger.error(f"❌ Instance refresh {status}")
-                return False
-            else:
-                percentage = refresh.get('PercentageComplete', 0)
-                logger.info(f"⏳ Instance refresh in progress: {percentage}%")
-                time.sleep(30)
+        describe = functools.partial(describe_refresh, self.autoscaling, asg_name, refresh_id)
+        refresh = wait_for_refresh(
+            describe, refresh_id, "Instance refresh in progress", self.region, BOTO_CONFIG
+        )
+        
+        if not refresh:
+            logger.error("Instance refresh not found")
+            return False
+        
+        status = refresh['Status']
+        if status == 'Successful':
+            logger.info("✅ Instance refresh completed successfully")
+            return True
+        
+        logger.error(f"❌ Instance refresh {status}")
+        return False
     
-    def verify_deployment(self, target_group_arn):
-        """Verify all instances are healthy"""
+    def verify_deployment(self, target_group_arns):
+        """Verify all instances in every target group are healthy"""
         logger.info("Verifying deployment health...")
         
+        if isinstance(target_group_arns, str):
+            target_group_arns = [target_group_arns]
+        
+        if not target_group_arns:
+            logger.error("❌ No target groups to verify")
+            return False
+        
         max_attempts = 20
-        for attempt in range(max_attempts):
-            response = self.elb.describe_target_health(
-                TargetGroupArn=target_group_arn
-            )
-            
-            total = len(response['TargetHealthDescriptions'])
-            healthy = sum(1 for t in response['TargetHealthDescriptions'] 
-                         if t['TargetHealth']['State'] == 'healthy')
-            
-            logger.info(f"Healthy targets: {healthy}/{total}")
-            
-            if healthy == total and total > 0:
-                logger.info("✅ All targets are healthy")
-                return True
-            
-            if attempt < max_attempts - 1:
-                time.sleep(15)
+        with ThreadPoolExecutor(max_workers=len(target_group_arns)) as executor:
+            for attempt in range(max_attempts):
+                # Describe all target groups in parallel
+                counts = list(executor.map(self._count_healthy_targets, target_group_arns))
+                
+                total = sum(t for _, t in counts)
+                healthy = sum(h for h, _ in counts)
+                
+                logger.info(f"Healthy targets: {healthy}/{total}")
+                
+                if all(h == t and t > 0 for h, t in counts):
+                    logger.info("✅ All targets are healthy")
+                    return True
+                
+                if attempt < max_attempts - 1:
+                    time.sleep(15)
         
         logger.error("❌ Not all targets became healthy")
         return False
     
+    def _count_healthy_targets(self, target_group_arn):
+        """Return (healthy, total) target counts for a target group"""
+        response = self.elb.describe_target_health(
+            TargetGroupArn=target_group_arn
+        )
+        
+        targets = response['TargetHealthDescriptions']
+        healthy = sum(1 for t in targets
+                      if t['TargetHealth']['State'] == 'healthy')
+        return healthy, len(targets)
+    
     def create_deployment_record(self, version, image, status):
         """Record deployment in S3"""
         bucket = f"{self.environment}-devops-artifacts"
-        key = f"deployments/{datetime.now().isoformat()}.json"
+        key = f"deployments/{new_record_id()}.json"
         
         record = {
             'timestamp': datetime.now().isoformat(),
@@ -204,11 +259,11 @@ exit 1
             'status': status
         }
         
-        import json
         self.s3.put_object(
             Bucket=bucket,
             Key=key,
-            Body=json.dumps(record, indent=2)
+            Body=dump_json(record, pretty=self.debug),
+            ContentType='application/json'
         )
         
         logger.info(f"Deployment record saved to s3://{bucket}/{key}")
@@ -225,6 +280,8 @@ def main():
                        help='Docker image with tag')
     parser.add_argument('--region', default='us-east-1', 
                        help='AWS region')
+    parser.add_argument('--debug', action='store_true',
+                       help='Enable debug logging and pretty-print S3 records')
     
     args = parser.parse_args()
     
@@ -232,7 +289,10 @@ def main():
     logger.info(f"Version: {args.version}")
     logger.info(f"Image: {args.image}")
     
-    deployer = DeploymentManager(args.environment, args.region)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+    
+    deployer = DeploymentManager(args.environment, args.region, args.debug)
     
     try:
         # Perform rolling deployment
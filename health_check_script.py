@@ -2,11 +2,15 @@
 # scripts/health_check.py
 
 import argparse
+import random
 import requests
 import time
 import sys
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logging.basicConfig(
     level=logging.INFO,
@@ -16,35 +20,95 @@ logger = logging.getLogger(__name__)
 
 
 class HealthChecker:
-    def __init__(self, url, timeout=300, interval=10):
-        self.url = url
+    def __init__(self, urls, timeout=300, interval=10):
+        self.urls = [urls] if isinstance(urls, str) else list(urls)
+        self.url = self.urls[0]
         self.timeout = timeout
         self.interval = interval
+        
+        # Reuse TCP/TLS connections across probes. Only gateway errors are
+        # retried here; refused connections and timeouts surface at once so
+        # wait_for_healthy can choose the backoff
+        self.session = requests.Session()
+        retries = Retry(
+            total=3,
+            connect=0,
+            read=0,
+            backoff_factor=0.3,
+            status_forcelist=[502, 503, 504],
+            raise_on_status=False,
+            respect_retry_after_header=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=len(self.urls),
+            pool_maxsize=max(4, len(self.urls)),
+            max_retries=retries
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        
+        # Probe all endpoints concurrently on each tick
+        self.executor = ThreadPoolExecutor(max_workers=len(self.urls))
     
-    def check_health(self):
+    def close(self):
+        """Release pooled connections"""
+        self.executor.shutdown(wait=False)
+        self.session.close()
+    
+    def check_health(self, url=None):
         """Check if the application is healthy"""
+        healthy, data, _ = self._probe(url or self.url)
+        return healthy, data
+    
+    def _probe(self, url):
+        """Probe one endpoint; returns (healthy, data, request exception or None)"""
         try:
-            response = requests.get(self.url, timeout=5)
+            response = self.session.get(url, timeout=(2, 5))
             
             if response.status_code == 200:
                 data = response.json()
                 logger.info(f"✅ Health check passed: {data}")
-                return True, data
+                return True, data, None
             else:
-                logger.warning(f"⚠️ Health check returned {response.status_code}")
-                return False, None
+                logger.warning(f"⚠️ Health check returned {response.status_code} from {url}")
+                return False, None, None
                 
         except requests.exceptions.RequestException as e:
-            logger.warning(f"⚠️ Health check failed: {str(e)}")
-            return False, None
+            logger.warning(f"⚠️ Health check failed for {url}: {str(e)}")
+            return False, None, e
+    
+    def check_all(self):
+        """Check every endpoint concurrently; healthy only if all pass
+        
+        errors holds one entry per URL: the request exception, or None when
+        the endpoint answered (healthy or not).
+        """
+        results = list(self.executor.map(self._probe, self.urls))
+        healthy = all(ok for ok, _, _ in results)
+        errors = [error for _, _, error in results]
+        return healthy, results[0][1] if healthy else None, errors
+    
+    def _next_delay(self, delay, errors):
+        """Pick the wait before the next attempt based on how the probes failed"""
+        if all(isinstance(e, requests.exceptions.ConnectionError)
+               and not isinstance(e, requests.exceptions.Timeout)
+               for e in errors):
+            # Nothing listening on any endpoint yet; the instance is still starting
+            return 1
+        if any(isinstance(e, requests.exceptions.Timeout) for e in errors):
+            # Possibly hung; give it the full interval
+            return self.interval
+        # Clamp after jitter so the wait never exceeds the interval
+        return min(self.interval, delay * random.uniform(0.5, 1.5))
     
     def wait_for_healthy(self):
         """Wait for application to become healthy"""
-        logger.info(f"Waiting for application to be healthy at {self.url}")
+        logger.info(f"Waiting for application to be healthy at {', '.join(self.urls)}")
         logger.info(f"Timeout: {self.timeout}s, Check interval: {self.interval}s")
         
         start_time = time.time()
         attempts = 0
+        delay = 1
         
         while True:
             attempts += 1
@@ -56,29 +120,41 @@ class HealthChecker:
             
             logger.info(f"Attempt {attempts} (elapsed: {elapsed:.1f}s)")
             
-            healthy, data = self.check_health()
+            healthy, data, errors = self.check_all()
             
             if healthy:
                 logger.info(f"✅ Application is healthy after {elapsed:.1f}s ({attempts} attempts)")
                 self.print_health_data(data)
                 return True
             
-            logger.info(f"Waiting {self.interval}s before next check...")
-            time.sleep(self.interval)
+            # Exponential backoff from 1s up to the configured interval
+            wait = self._next_delay(delay, errors)
+            delay = min(delay * 2, self.interval)
+            
+            logger.info(f"Waiting {wait:.1f}s before next check...")
+            time.sleep(wait)
     
     def print_health_data(self, data):
         """Print detailed health information"""
         if not data:
             return
         
-        logger.info("=" * 50)
-        logger.info("Health Check Details:")
-        logger.info(f"  Status: {data.get('status', 'unknown')}")
-        logger.info(f"  Timestamp: {data.get('timestamp', 'unknown')}")
-        logger.info(f"  Uptime: {data.get('uptime', 0):.2f}s")
-        logger.info(f"  Environment: {data.get('environment', 'unknown')}")
-        logger.info(f"  Version: {data.get('version', 'unknown')}")
-        logger.info("=" * 50)
+        separator = "=" * 50
+        logger.info(
+            "%s\nHealth Check Details:\n"
+            "  Status: %s\n"
+            "  Timestamp: %s\n"
+            "  Uptime: %.2fs\n"
+            "  Environment: %s\n"
+            "  Version: %s\n%s",
+            separator,
+            data.get('status', 'unknown'),
+            data.get('timestamp', 'unknown'),
+            data.get('uptime', 0),
+            data.get('environment', 'unknown'),
+            data.get('version', 'unknown'),
+            separator
+        )
     
     def continuous_monitoring(self, duration=3600):
         """Continuously monitor health for specified duration"""
@@ -90,7 +166,7 @@ class HealthChecker:
         
         while time.time() - start_time < duration:
             check_count += 1
-            healthy, data = self.check_health()
+            healthy, _, _ = self.check_all()
             
             if not healthy:
                 failed_checks += 1
@@ -117,15 +193,18 @@ class HealthChecker:
         logger.info(f"Checking metrics endpoint: {metrics_url}")
         
         try:
-            response = requests.get(metrics_url, timeout=5)
-            
-            if response.status_code == 200:
-                metrics_count = len(response.text.split('\n'))
-                logger.info(f"✅ Metrics endpoint available ({metrics_count} lines)")
-                return True
-            else:
-                logger.warning(f"⚠️ Metrics endpoint returned {response.status_code}")
-                return False
+            with self.session.get(metrics_url, timeout=(2, 5), stream=True) as response:
+                if response.status_code == 200:
+                    # Count lines on raw byte chunks instead of decoding the body
+                    metrics_count = sum(
+                        chunk.count(b'\n')
+                        for chunk in response.iter_content(chunk_size=65536)
+                    )
+                    logger.info(f"✅ Metrics endpoint available ({metrics_count} lines)")
+                    return True
+                else:
+                    logger.warning(f"⚠️ Metrics endpoint returned {response.status_code}")
+                    return False
                 
         except requests.exceptions.RequestException as e:
             logger.warning(f"⚠️ Metrics check failed: {str(e)}")
@@ -134,8 +213,8 @@ class HealthChecker:
 
 def main():
     parser = argparse.ArgumentParser(description='Health check utility')
-    parser.add_argument('--url', required=True, 
-                       help='Health check URL')
+    parser.add_argument('--url', required=True, action='append',
+                       help='Health check URL (repeat to probe several endpoints)')
     parser.add_argument('--timeout', type=int, default=300, 
                        help='Timeout in seconds')
     parser.add_argument('--interval', type=int, default=10, 
@@ -169,6 +248,8 @@ def main():
     except Exception as e:
         logger.error(f"❌ Error: {str(e)}")
         sys.exit(1)
+    finally:
+        checker.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,236 @@
+# scripts/refresh_events.py
+
+import boto3
+import contextlib
+import json
+import logging
+import random
+import signal
+import time
+from botocore.exceptions import BotoCoreError, ClientError
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATES = ('Successful', 'Cancelled', 'Failed')
+
+# EventBridge detail-type suffix -> DescribeInstanceRefreshes status
+EVENT_STATUSES = {
+    'Succeeded': 'Successful',
+    'Cancelled': 'Cancelled',
+    'Failed': 'Failed',
+}
+
+THROTTLING_CODES = ('Throttling', 'RequestLimitExceeded')
+
+
+class RefreshEventListener:
+    """Temporary SQS queue subscribed to EventBridge events for one instance refresh"""
+    
+    def __init__(self, refresh_id, region='us-east-1', config=None):
+        self.refresh_id = refresh_id
+        self.name = f"instance-refresh-{refresh_id}"
+        self.sqs = boto3.client('sqs', region_name=region, config=config)
+        self.events = boto3.client('events', region_name=region, config=config)
+        self.queue_url = None
+        self.rule_created = False
+        self.target_added = False
+    
+    def open(self):
+        """Create the queue and route this refresh's events to it"""
+        self.queue_url = self.sqs.create_queue(QueueName=self.name)['QueueUrl']
+        queue_arn = self.sqs.get_queue_attributes(
+            QueueUrl=self.queue_url,
+            AttributeNames=['QueueArn']
+        )['Attributes']['QueueArn']
+        
+        rule_arn = self.events.put_rule(
+            Name=self.name,
+            EventPattern=json.dumps({
+                'source': ['aws.autoscaling'],
+                'detail-type': [{'prefix': 'EC2 Auto Scaling Instance Refresh'}],
+                'detail': {'InstanceRefreshId': [self.refresh_id]}
+            }),
+            State='ENABLED'
+        )['RuleArn']
+        self.rule_created = True
+        
+        # Allow only this rule to deliver to the queue
+        self.sqs.set_queue_attributes(
+            QueueUrl=self.queue_url,
+            Attributes={'Policy': json.dumps({
+                'Version': '2012-10-17',
+                'Statement': [{
+                    'Effect': 'Allow',
+                    'Principal': {'Service': 'events.amazonaws.com'},
+                    'Action': 'sqs:SendMessage',
+                    'Resource': queue_arn,
+                    'Condition': {'ArnEquals': {'aws:SourceArn': rule_arn}}
+                }]
+            })}
+        )
+        
+        self.events.put_targets(
+            Rule=self.name,
+            Targets=[{'Id': 'refresh-queue', 'Arn': queue_arn}]
+        )
+        self.target_added = True
+        logger.info(f"Subscribed to instance refresh events for {self.refresh_id}")
+    
+    def close(self):
+        """Remove the target, rule and queue; failures are logged, not raised"""
+        if self.target_added:
+            try:
+                self.events.remove_targets(Rule=self.name, Ids=['refresh-queue'])
+                self.target_added = False
+            except (BotoCoreError, ClientError) as e:
+                logger.warning(f"Failed to remove targets from rule {self.name}: {e}")
+        
+        if self.rule_created:
+            try:
+                self.events.delete_rule(Name=self.name)
+                self.rule_created = False
+            except (BotoCoreError, ClientError) as e:
+                logger.warning(f"Failed to delete rule {self.name}: {e}")
+        
+        if self.queue_url:
+            try:
+                self.sqs.delete_queue(QueueUrl=self.queue_url)
+                self.queue_url = None
+            except (BotoCoreError, ClientError) as e:
+                logger.warning(f"Failed to delete queue {self.name}: {e}")
+    
+    def wait(self, timeout=60):
+        """Long-poll until a terminal refresh event arrives or timeout elapses
+        
+        Returns the terminal status, or None on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            
+            response = self.sqs.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=10,
+                WaitTimeSeconds=max(1, min(20, int(remaining)))
+            )
+            
+            messages = response.get('Messages', [])
+            if messages:
+                self._delete(messages)
+            
+            for message in messages:
+                event = json.loads(message['Body'])
+                detail_type = event.get('detail-type', '')
+                logger.info(f"Received event: {detail_type}")
+                
+                status = EVENT_STATUSES.get(detail_type.rsplit(' ', 1)[-1])
+                if status:
+                    return status
+    
+    def _delete(self, messages):
+        """Delete handled messages so they are not redelivered after the visibility timeout"""
+        try:
+            self.sqs.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{'Id': str(i), 'ReceiptHandle': message['ReceiptHandle']}
+                         for i, message in enumerate(messages)]
+            )
+        except (BotoCoreError, ClientError) as e:
+            logger.warning(f"Failed to delete refresh events from {self.name}: {e}")
+
+
+@contextlib.contextmanager
+def _exit_on_sigterm():
+    """Turn SIGTERM (e.g. a Jenkins abort) into SystemExit so cleanup runs"""
+    def handler(signum, frame):
+        raise SystemExit(128 + signum)
+    
+    try:
+        previous = signal.signal(signal.SIGTERM, handler)
+    except ValueError:
+        # Signal handlers can only be installed from the main thread
+        yield
+        return
+    
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+
+
+def describe_refresh(autoscaling, asg_name, refresh_id):
+    """Return the current state of an instance refresh, or None if it no longer exists"""
+    response = autoscaling.describe_instance_refreshes(
+        AutoScalingGroupName=asg_name,
+        InstanceRefreshIds=[refresh_id]
+    )
+    refreshes = response['InstanceRefreshes']
+    return refreshes[0] if refreshes else None
+
+
+def _describe(describe_fn, max_delay=30):
+    """Call describe_fn, backing off and retrying while the API throttles"""
+    while True:
+        try:
+            return describe_fn()
+        except ClientError as e:
+            if e.response['Error']['Code'] not in THROTTLING_CODES:
+                raise
+            logger.warning(f"Throttled while polling, backing off {max_delay}s")
+            time.sleep(max_delay * random.uniform(1, 1.5))
+
+
+def poll_until(describe_fn, terminal_states, progress_message, initial=5, max_delay=30):
+    """Poll describe_fn with exponential backoff and jitter until terminal
+    
+    describe_fn returns the current refresh (or None if it no longer exists);
+    progress_message prefixes the percentage logged while waiting.
+    """
+    delay = initial
+    
+    while True:
+        refresh = _describe(describe_fn, max_delay)
+        
+        if not refresh or refresh['Status'] in terminal_states:
+            return refresh
+        
+        percentage = refresh.get('PercentageComplete', 0)
+        logger.info(f"⏳ {progress_message}: {percentage}%")
+        time.sleep(delay * random.uniform(0.5, 1.5))
+        delay = min(delay * 2, max_delay)
+
+
+def wait_for_refresh(describe_fn, refresh_id, progress_message,
+                     region='us-east-1', config=None, progress_interval=60):
+    """Wait for an instance refresh to reach a terminal state
+    
+    Wakes on EventBridge state-change events and confirms with describe_fn,
+    which also reports progress at least every progress_interval seconds.
+    Falls back to poll_until if the event subscription cannot be created.
+    """
+    with _exit_on_sigterm():
+        listener = RefreshEventListener(refresh_id, region, config)
+        try:
+            listener.open()
+        except (BotoCoreError, ClientError) as e:
+            listener.close()
+            logger.warning(f"Refresh events unavailable, polling instead: {e}")
+            return poll_until(describe_fn, TERMINAL_STATES, progress_message)
+        except BaseException:
+            # e.g. SIGTERM after the queue or rule was already created
+            listener.close()
+            raise
+        
+        try:
+            refresh = _describe(describe_fn)
+            while refresh and refresh['Status'] not in TERMINAL_STATES:
+                percentage = refresh.get('PercentageComplete', 0)
+                logger.info(f"⏳ {progress_message}: {percentage}%")
+                listener.wait(timeout=progress_interval)
+                refresh = _describe(describe_fn)
+            return refresh
+        finally:
+            listener.close()
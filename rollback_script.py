@@ -2,11 +2,30 @@
 # scripts/rollback.py
 
 import argparse
+import base64
 import boto3
-import json
+import functools
+import heapq
+import os
+import re
+import time
 import sys
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from botocore.exceptions import ClientError
+
+try:
+    from platformdirs import user_cache_dir
+except ImportError:
+    def user_cache_dir(appname):
+        return os.path.join(os.path.expanduser('~/.cache'), appname)
+
+from aws_helpers import (
+    BOTO_CONFIG, describe_asg, dump_json, load_json, new_record_id, record_timestamp
+)
+from refresh_events import describe_refresh, wait_for_refresh
+from user_data import build_user_data
 
 logging.basicConfig(
     level=logging.INFO,
@@ -14,14 +33,75 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+DOCKER_PULL_RE = re.compile(r'^docker pull (\S+)', re.MULTILINE)
+
+# Records kept in the on-disk history cache; covers the largest history limit
+HISTORY_CACHE_ENTRIES = 100
+
+
+def record_sort_key(key):
+    """Chronological sort key for a record key named by ULID or ISO timestamp"""
+    name = os.path.splitext(os.path.basename(key))[0]
+    return record_timestamp(name) or 0, name
+
+
+class DiskCache:
+    """On-disk cache of S3 object bodies keyed by object key, with ETags"""
+    
+    def __init__(self, namespace):
+        self.directory = os.path.join(user_cache_dir('devops'), namespace)
+    
+    def _path(self, key):
+        return os.path.join(self.directory, key.replace('/', '_'))
+    
+    def get(self, key):
+        """Return (etag, body) for a cached object, or None"""
+        try:
+            with open(self._path(key), 'rb') as f:
+                entry = load_json(f.read())
+            return entry['etag'], entry['body'].encode()
+        except (OSError, ValueError, KeyError):
+            return None
+    
+    def put(self, key, etag, body):
+        """Store an object body and its ETag"""
+        path = self._path(key)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(dump_json({'etag': etag, 'body': body.decode()}))
+            os.replace(tmp_path, path)
+        except (OSError, ValueError) as e:
+            logger.debug(f"Failed to cache {key}: {e}")
+    
+    def prune(self, max_entries):
+        """Remove all but the max_entries most recently written entries"""
+        try:
+            with os.scandir(self.directory) as entries:
+                mtimes = {entry.name: entry.stat().st_mtime for entry in entries}
+        except OSError:
+            return
+        
+        keep = set(heapq.nlargest(max_entries, mtimes, key=mtimes.get))
+        for name in mtimes.keys() - keep:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError as e:
+                logger.debug(f"Failed to prune cache entry {name}: {e}")
+
 
 class RollbackManager:
-    def __init__(self, environment, region='us-east-1'):
+    def __init__(self, environment, region='us-east-1', debug=False):
         self.environment = environment
         self.region = region
-        self.autoscaling = boto3.client('autoscaling', region_name=region)
-        self.ec2 = boto3.client('ec2', region_name=region)
-        self.s3 = boto3.client('s3', region_name=region)
+        self.debug = debug
+        self.autoscaling = boto3.client('autoscaling', region_name=region, config=BOTO_CONFIG)
+        self.ec2 = boto3.client('ec2', region_name=region, config=BOTO_CONFIG)
+        self.s3 = boto3.client('s3', region_name=region, config=BOTO_CONFIG)
+        self._asg_cache = {}
+        self._lt_versions_cache = {}
+        self.history_cache = DiskCache(os.path.join('deployments', environment))
     
     def get_deployment_history(self, limit=10):
         """Retrieve deployment history from S3"""
@@ -29,41 +109,64 @@ class RollbackManager:
         prefix = "deployments/"
         
         try:
-            response = self.s3.list_objects_v2(
-                Bucket=bucket,
-                Prefix=prefix,
-                MaxKeys=limit
-            )
+            # S3 lists keys in ascending order, so the newest records are only
+            # known once every page has been seen; keep just the top `limit`
+            keys = heapq.nlargest(limit, self._iter_keys(bucket, prefix), key=record_sort_key)
             
-            if 'Contents' not in response:
+            if not keys:
                 logger.warning("No deployment history found")
                 return []
             
-            # Sort by last modified (most recent first)
-            objects = sorted(
-                response['Contents'], 
-                key=lambda x: x['LastModified'], 
-                reverse=True
-            )
-            
-            deployments = []
-            for obj in objects:
-                try:
-                    response = self.s3.get_object(
-                        Bucket=bucket,
-                        Key=obj['Key']
-                    )
-                    data = json.loads(response['Body'].read())
-                    deployments.append(data)
-                except Exception as e:
-                    logger.warning(f"Failed to read {obj['Key']}: {e}")
+            # Fetch records in parallel; map() preserves key order
+            with ThreadPoolExecutor(max_workers=16) as executor:
+                records = executor.map(lambda key: self._fetch_json(bucket, key), keys)
+                records = [record for record in records if record is not None]
             
-            return deployments
+            self.history_cache.prune(HISTORY_CACHE_ENTRIES)
+            return records
             
         except Exception as e:
             logger.error(f"Failed to retrieve deployment history: {e}")
             return []
     
+    def _iter_keys(self, bucket, prefix):
+        """Yield every object key under prefix, one listing page at a time"""
+        paginator = self.s3.get_paginator('list_objects_v2')
+        pages = paginator.paginate(
+            Bucket=bucket,
+            Prefix=prefix,
+            PaginationConfig={'PageSize': 1000}
+        )
+        for page in pages:
+            for obj in page.get('Contents', []):
+                yield obj['Key']
+    
+    def _fetch_json(self, bucket, key):
+        """Read a single JSON record from S3, revalidating the disk cache"""
+        cached = self.history_cache.get(key)
+        conditional = {'IfNoneMatch': cached[0]} if cached else {}
+        
+        try:
+            response = self.s3.get_object(Bucket=bucket, Key=key, **conditional)
+            body = response['Body'].read()
+        except ClientError as e:
+            if not cached or e.response['Error']['Code'] not in ('304', 'NotModified'):
+                logger.warning(f"Failed to read {key}: {e}")
+                return None
+            # Not modified since cached
+            body = cached[1]
+        except Exception as e:
+            logger.warning(f"Failed to read {key}: {e}")
+            return None
+        else:
+            self.history_cache.put(key, response['ETag'], body)
+        
+        try:
+            return load_json(body)
+        except ValueError as e:
+            logger.warning(f"Failed to parse {key}: {e}")
+            return None
+    
     def find_previous_successful_deployment(self):
         """Find the most recent successful deployment"""
         history = self.get_deployment_history(limit=20)
@@ -79,6 +182,19 @@ class RollbackManager:
         logger.error("No successful deployment found in history")
         return None
     
+    def find_deployment_image(self, target_version):
+        """Find the image of a successful deployment of target_version"""
+        history = self.get_deployment_history(limit=100)
+        
+        for deployment in history:
+            if (deployment.get('status') == 'success'
+                    and str(deployment.get('version')) == str(target_version)
+                    and deployment.get('image')):
+                return deployment['image']
+        
+        logger.error(f"No successful deployment of version {target_version} found in history")
+        return None
+    
     def rollback_to_version(self, target_version=None, target_image=None):
         """Rollback to a specific version or previous successful deployment"""
         logger.info(f"🔄 Starting rollback for {self.environment}")
@@ -91,29 +207,30 @@ class RollbackManager:
             
             target_version = deployment['version']
             target_image = deployment['image']
+        elif not target_image:
+            # Only a version was given; look up the image it deployed
+            target_image = self.find_deployment_image(target_version)
+        
+        if not target_image:
+            logger.error("No target image to roll back to")
+            return False
         
         logger.info(f"Rolling back to version {target_version}")
         logger.info(f"Image: {target_image}")
         
         # Get ASG and launch template info
         asg_name = f"{self.environment}-asg"
-        response = self.autoscaling.describe_auto_scaling_groups(
-            AutoScalingGroupNames=[asg_name]
-        )
+        asg = describe_asg(self.autoscaling, asg_name, self._asg_cache)
         
-        if not response['AutoScalingGroups']:
+        if not asg:
             logger.error(f"ASG {asg_name} not found")
             return False
         
-        asg = response['AutoScalingGroups'][0]
         lt_id = asg['LaunchTemplate']['LaunchTemplateId']
         
-        # Get launch template versions
-        lt_versions = self.get_launch_template_versions(lt_id)
-        
-        # Find version with matching image
+        # Find launch template version with matching image
         target_lt_version = self.find_matching_launch_template(
-            lt_versions, target_image
+            lt_id, target_image
         )
         
         if not target_lt_version:
@@ -159,40 +276,50 @@ class RollbackManager:
         
         return success
     
-    def get_launch_template_versions(self, lt_id):
-        """Get all versions of a launch template"""
+    def get_launch_template_versions(self, lt_id, ttl=60):
+        """Get all versions of a launch template (cached for ttl seconds)"""
+        cached = self._lt_versions_cache.get(lt_id)
+        if cached and time.monotonic() - cached[0] < ttl:
+            return cached[1]
+        
         response = self.ec2.describe_launch_template_versions(
             LaunchTemplateId=lt_id,
             MaxResults=100
         )
-        return response['LaunchTemplateVersions']
+        versions = response['LaunchTemplateVersions']
+        self._lt_versions_cache[lt_id] = (
+            time.monotonic(), versions, self._build_image_index(versions)
+        )
+        return versions
     
-    def find_matching_launch_template(self, versions, target_image):
-        """Find launch template version with matching image"""
+    @staticmethod
+    def _build_image_index(versions):
+        """Map each Docker image to the newest version whose user data pulls it"""
+        index = {}
         for version in versions:
-            user_data = version.get('LaunchTemplateData', {}).get('UserData', '')
-            if target_image in user_data:
-                return version['VersionNumber']
-        return None
+            user_data = version.get('LaunchTemplateData', {}).get('UserData')
+            if not user_data:
+                continue
+            
+            try:
+                script = base64.b64decode(user_data).decode('utf-8', errors='replace')
+            except ValueError:
+                continue
+            
+            number = version['VersionNumber']
+            for image in DOCKER_PULL_RE.findall(script):
+                if number > index.get(image, 0):
+                    index[image] = number
+        return index
+    
+    def find_matching_launch_template(self, lt_id, target_image):
+        """Find launch template version with matching image"""
+        self.get_launch_template_versions(lt_id)
+        return self._lt_versions_cache[lt_id][2].get(target_image)
     
     def create_rollback_version(self, lt_id, target_image):
         """Create new launch template version for rollback"""
-        import base64
-        
-        script = f"""#!/bin/bash
-set -e
-docker pull {target_image}
-docker stop app || true
-docker rm app || true
-docker run -d \\
-  --name app \\
-  --restart unless-stopped \\
-  -p 3000:3000 \\
-  -e NODE_ENV={self.environment} \\
-  {target_image}
-"""
-        
-        user_data = base64.b64encode(script.encode()).decode()
+        user_data = build_user_data(self.environment, target_image)
         
         response = self.ec2.create_launch_template_version(
             LaunchTemplateId=lt_id,
@@ -200,38 +327,23 @@ docker run -d \\
                 'UserData': user_data
             }
         )
+        self._lt_versions_cache.pop(lt_id, None)
         
         return response['LaunchTemplateVersion']['VersionNumber']
     
     def monitor_refresh(self, asg_name, refresh_id):
         """Monitor instance refresh progress"""
-        import time
+        describe = functools.partial(describe_refresh, self.autoscaling, asg_name, refresh_id)
+        refresh = wait_for_refresh(
+            describe, refresh_id, "Rollback in progress", self.region, BOTO_CONFIG
+        )
         
-        while True:
-            response = self.autoscaling.describe_instance_refreshes(
-                AutoScalingGroupName=asg_name,
-                InstanceRefreshIds=[refresh_id]
-            )
-            
-            if not response['InstanceRefreshes']:
-                return False
-            
-            refresh = response['InstanceRefreshes'][0]
-            status = refresh['Status']
-            
-            if status == 'Successful':
-                return True
-            elif status in ['Cancelled', 'Failed']:
-                return False
-            else:
-                percentage = refresh.get('PercentageComplete', 0)
-                logger.info(f"⏳ Rollback in progress: {percentage}%")
-                time.sleep(30)
+        return bool(refresh) and refresh['Status'] == 'Successful'
     
     def record_rollback(self, version, image):
         """Record rollback operation"""
         bucket = f"{self.environment}-devops-artifacts"
-        key = f"rollbacks/{datetime.now().isoformat()}.json"
+        key = f"rollbacks/{new_record_id()}.json"
         
         record = {
             'timestamp': datetime.now().isoformat(),
@@ -244,7 +356,8 @@ docker run -d \\
         self.s3.put_object(
             Bucket=bucket,
             Key=key,
-            Body=json.dumps(record, indent=2)
+            Body=dump_json(record, pretty=self.debug),
+            ContentType='application/json'
         )
         
         logger.info(f"Rollback record saved to s3://{bucket}/{key}")
@@ -261,12 +374,17 @@ def main():
                        help='Specific Docker image to rollback to')
     parser.add_argument('--region', default='us-east-1',
                        help='AWS region')
+    parser.add_argument('--debug', action='store_true',
+                       help='Enable debug logging and pretty-print S3 records')
     
     args = parser.parse_args()
     
     logger.info(f"🔄 Initiating rollback for {args.environment}")
     
-    manager = RollbackManager(args.environment, args.region)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+    
+    manager = RollbackManager(args.environment, args.region, args.debug)
     
     try:
         success = manager.rollback_to_version(
@@ -0,0 +1,45 @@
+# scripts/user_data.py
+
+import base64
+import functools
+import string
+
+# Launch template user data: pull and (re)start the app container, then
+# wait for its health endpoint
+USER_DATA_TEMPLATE = string.Template("""#!/bin/bash
+set -e
+
+# Pull new image
+docker pull $image
+
+# Stop old container
+docker stop app || true
+docker rm app || true
+
+# Run new container
+docker run -d \\
+  --name app \\
+  --restart unless-stopped \\
+  -p 3000:3000 \\
+  -e NODE_ENV=$environment \\
+  $image
+
+# Wait for health check
+for i in {1..30}; do
+  if curl -f http://localhost:3000/health > /dev/null 2>&1; then
+    echo "Application is healthy!"
+    exit 0
+  fi
+  sleep 2
+done
+
+echo "Application failed to start"
+exit 1
+""")
+
+
+@functools.lru_cache(maxsize=None)
+def build_user_data(environment, image):
+    """Render and base64-encode the user data script (memoized)"""
+    script = USER_DATA_TEMPLATE.substitute(environment=environment, image=image)
+    return base64.b64encode(script.encode()).decode()